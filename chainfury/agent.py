@@ -5,15 +5,18 @@ Agent
 We follow registry pattern for models and actions.
 """
 
+import re
 import copy
 from uuid import uuid4
+from collections import defaultdict
 from typing import Any, List, Optional, Dict, Tuple
 
 import jinja2
 
-from chainfury.utils import logger
+from chainfury.utils import logger, get_response_cache, response_cache_key, get_similarity_cache, text_sketch
 from chainfury.base import (
-    func_to_vars,
+    cached_func_to_vars,
+    cached_func_to_return_vars,
     func_to_return_vars,
     extract_jinja_indices,
     get_value_by_keys,
@@ -23,6 +26,42 @@ from chainfury.base import (
     Var,
 )
 
+# all the AI actions share a single jinja environment so templates are compiled with the same settings and the
+# environment is not looked up for every template
+_JINJA_ENV = jinja2.Environment(autoescape=False)
+
+# templates that only substitute plain variables eg. "Hello {{ name }}" are rendered by string joins instead of jinja
+_SIMPLE_VAR = re.compile(r"{{\s*([A-Za-z_][A-Za-z0-9_]*)\s*}}")
+_JINJA_LITERALS = frozenset(["true", "false", "none", "True", "False", "None"])
+
+
+class _SimpleTemplate:
+    """Renders a template made of only `{{ var }}` substitutions, the output is the same as the jinja template."""
+
+    def __init__(self, parts: List[str]):
+        self.parts = parts  # literal, name, literal, name, ..., literal
+
+    def render(self, **data) -> str:
+        out = self.parts[:]
+        for i in range(1, len(out), 2):
+            v = data.get(out[i])
+            out[i] = "" if v is None and out[i] not in data else str(v)
+        return "".join(out)
+
+
+def _compile_template(source: str):
+    """Compile the template once, uses `_SimpleTemplate` when possible otherwise falls back to jinja."""
+    rest = _SIMPLE_VAR.sub("", source)
+    if "{{" in rest or "{%" in rest or "{#" in rest or "\r" in source:
+        return _JINJA_ENV.from_string(source)
+    # jinja reads these names as literals or globals and not from the data
+    if any(name in _JINJA_LITERALS or name in _JINJA_ENV.globals for name in _SIMPLE_VAR.findall(source)):
+        return _JINJA_ENV.from_string(source)
+    if source.endswith("\n"):
+        source = source[:-1]  # jinja drops a single trailing newline by default
+    return _SimpleTemplate(_SIMPLE_VAR.split(source))
+
+
 # Models
 # ------
 # All the things below are for the models that are registered in the model registry, so that they can be used as inputs
@@ -34,8 +73,9 @@ class ModelRegistry:
 
     def __init__(self):
         self.models: Dict[str, Model] = {}
-        self.counter: Dict[str, int] = {}
+        self.counter: Dict[str, int] = defaultdict(int)
         self.tags_to_models: Dict[str, List[str]] = {}
+        self._dict_cache: Dict[str, Dict[str, Dict[str, Any]]] = {}  # tag -> serialised models, reset on register
 
     def has(self, id: str):
         """A helper function to check if a model is registered or not"""
@@ -52,6 +92,7 @@ class ModelRegistry:
         if id in self.models:
             raise Exception(f"Model {id} already registered")
         self.models[id] = model
+        self._dict_cache.clear()
         for tag in model.tags:
             self.tags_to_models[tag] = self.tags_to_models.get(tag, []) + [id]
 
@@ -64,7 +105,8 @@ class ModelRegistry:
         return list(self.tags_to_models.keys())
 
     def get_models(self, tag: str = "") -> Dict[str, Dict[str, Any]]:
-        """Get all the models that are registered in the registry
+        """Get all the models that are registered in the registry. The result is cached until the next `register` so it
+        should not be modified.
 
         Args:
             tag (str, optional): Filter models by tag. Defaults to "".
@@ -72,10 +114,10 @@ class ModelRegistry:
         Returns:
             Dict[str, Dict[str, Any]]: Dictionary of models
         """
-        items = {k: v.to_dict() for k, v in self.models.items()}
-        if tag:
-            items = {k: v for k, v in items.items() if tag in v.get("tags", [])}
-        return items
+        if tag not in self._dict_cache:
+            ids = self.tags_to_models.get(tag, []) if tag else self.models
+            self._dict_cache[tag] = {k: self.models[k].to_dict() for k in ids}
+        return self._dict_cache[tag]
 
     def get(self, id: str) -> Model:
         """Get a model from the registry
@@ -86,7 +128,7 @@ class ModelRegistry:
         Returns:
             Model: Model
         """
-        self.counter[id] = self.counter.get(id, 0) + 1
+        self.counter[id] += 1
         out = self.models.get(id, None)
         if out is None:
             raise ValueError(f"Model {id} not found")
@@ -123,8 +165,12 @@ class ProgramaticActionsRegistry:
 
     def __init__(self):
         self.nodes: Dict[str, Node] = {}
-        self.counter: Dict[str, int] = {}
+        self.counter: Dict[str, int] = defaultdict(int)
         self.tags_to_nodes: Dict[str, List[str]] = {}
+        self._dict_cache: Dict[str, Dict[str, Dict[str, Any]]] = {}  # tag -> serialised nodes, reset on register
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.nodes
 
     def register(
         self,
@@ -159,17 +205,18 @@ class ProgramaticActionsRegistry:
             outputs = {x: () for x in returns}
         else:
             assert len(outputs), "If returns is not provided then outputs must be provided"
-        ops = func_to_return_vars(func=fn, returns=outputs)
+        ops = cached_func_to_return_vars(func=fn, returns=outputs)
         node = Node(
             id=node_id,
             type=Node.types.PROGRAMATIC,
             fn=fn,
             description=description,
-            fields=func_to_vars(fn),
+            fields=cached_func_to_vars(fn),
             outputs=ops,
             tags=tags,
         )
         self.nodes[node_id] = node
+        self._dict_cache.clear()
         for tag in tags:
             self.tags_to_nodes[tag] = self.tags_to_nodes.get(tag, []) + [node_id]
         return self.nodes[node_id]
@@ -183,7 +230,8 @@ class ProgramaticActionsRegistry:
         return list(self.tags_to_nodes.keys())
 
     def get_nodes(self, tag: str = "") -> Dict[str, Dict[str, Any]]:
-        """Get all the nodes that are registered in the registry
+        """Get all the nodes that are registered in the registry. The result is cached until the next `register` so it
+        should not be modified.
 
         Args:
             tag (str, optional): Filter nodes by tag. Defaults to "".
@@ -191,10 +239,10 @@ class ProgramaticActionsRegistry:
         Returns:
             Dict[str, Dict[str, Any]]: Dictionary of nodes
         """
-        items = {k: v.to_dict() for k, v in self.nodes.items()}
-        if tag:
-            items = {k: v for k, v in items.items() if tag in v.get("tags", [])}
-        return items
+        if tag not in self._dict_cache:
+            ids = self.tags_to_nodes.get(tag, []) if tag else self.nodes
+            self._dict_cache[tag] = {k: self.nodes[k].to_dict() for k in ids}
+        return self._dict_cache[tag]
 
     def get(self, node_id: str) -> Optional[Node]:
         """Get a node from the registry
@@ -205,7 +253,7 @@ class ProgramaticActionsRegistry:
         Returns:
             Node: Node
         """
-        self.counter[node_id] = self.counter.get(node_id, 0) + 1
+        self.counter[node_id] += 1
         out = self.nodes.get(node_id, None)
         if out is None:
             raise ValueError(f"p-node '{node_id}' not found")
@@ -245,6 +293,9 @@ class AIAction:
         model (Model): The model that is used for this action
         model_params (Dict[str, Any]): The parameters for the model
         fn (object): The function that is used for this action
+        similarity_threshold (float, optional): J-type actions only, calls whose rendered templates are at least this
+            similar to an earlier call with the same params are served from the fuzzy response cache. Defaults to 0
+            which disables it.
     """
 
     # do not remove these from here it is used in base.py if you do then put in a third file
@@ -254,15 +305,24 @@ class AIAction:
     FUNC = "python-function"
     """constant for Python function type"""
 
-    def __init__(self, node_id: str, model: Model, model_params: Dict[str, Any], fn: object, action_name: str):
+    def __init__(
+        self,
+        node_id: str,
+        model: Model,
+        model_params: Dict[str, Any],
+        fn: object,
+        action_name: str,
+        similarity_threshold: float = 0.0,
+    ):
         # do some basic checks that we can do before anything else like checking if model_params
         # is a subset of the model.vars
-        fields = set(x.name for x in model.vars)
         mp_set = set(model_params.keys())
-        if not mp_set.issubset(fields):
-            raise Exception(f"Model params {mp_set} not a subset of {fields}")
+        if not mp_set.issubset(model.var_names):
+            raise Exception(f"Model params {mp_set} not a subset of {set(model.var_names)}")
 
         self.templates = []
+        self._spine_paths = []
+        self._skeleton = None
 
         # since this is the AI action this is responsible for validating the function
         if type(fn) == dict:
@@ -275,14 +335,21 @@ class AIAction:
                 obj = get_value_by_keys(fn, field[0])
                 if not obj:
                     raise ValueError(f"Field {field[0]} not found in {fn}, but was extraced. There is a bug in get_value_by_keys function")
-                templates.append((obj, jinja2.Template(obj), field[0]))
+                templates.append((obj, _compile_template(obj), field[0]))
 
             # set values
             self.templates = templates
+
+            # `fn` with all the templated leaves emptied out, on every call only the containers on the path to these
+            # leaves are copied and the rest of the tree is shared
+            self._spine_paths = [keys if isinstance(keys, tuple) else (keys,) for _, _, keys in templates]
+            self._skeleton = copy.deepcopy(fn)
+            for keys in self._spine_paths:
+                put_value_by_keys(self._skeleton, keys, None)
         else:
             assert type(fn) == type(func_to_return_vars), "`fn` can either be a function or a string"
             action_source = AIAction.FUNC
-            fields = func_to_vars(fn)
+            fields = cached_func_to_vars(fn)
 
         self.node_id = node_id
         self.model = model
@@ -291,6 +358,18 @@ class AIAction:
         self.action_name = action_name
         self.action_source = action_source
         self.fields = fields
+        self._field_names = frozenset(f.name for f in fields)
+        self._required_names = frozenset(f.name for f in fields if f.required)
+
+        self.similarity_threshold = similarity_threshold
+
+    def __deepcopy__(self, memo):
+        # compiled templates are immutable and cannot be deep copied, so they are shared between the copies
+        out = AIAction.__new__(AIAction)
+        memo[id(self)] = out
+        for k, v in self.__dict__.items():
+            setattr(out, k, v if k == "templates" else copy.deepcopy(v, memo))
+        return out
 
     def to_dict(self, no_vars: bool = False) -> Dict[str, Any]:
         """Serialize the AIAction object to a dict."""
@@ -301,6 +380,7 @@ class AIAction:
             "fn": self.fn,
             "action_name": self.action_name,
             "action_source": self.action_source,
+            "similarity_threshold": self.similarity_threshold,
         }
 
     @classmethod
@@ -312,6 +392,7 @@ class AIAction:
             model_params=data["model_params"],
             fn=data["fn"],
             action_name=data.get("action_name", data["node_id"]),
+            similarity_threshold=data.get("similarity_threshold", 0.0),
         )
 
     def __call__(self, **data: Dict[str, Any]) -> Tuple[Any, Optional[Exception]]:
@@ -327,12 +408,10 @@ class AIAction:
         # check for keys even before calling any API or something
         # we need to create a sub dict that only contains the fields that are needed by the preprocessor
         # function and pass the rest of the data to the model call
-        _data = {}
-        for f in self.fields:
-            if f.required and f.name not in data:
-                raise Exception(f"Field {f.name} is required in {self.node_id} but not present")
-            if f.name in data:
-                _data[f.name] = data.pop(f.name)
+        missing = self._required_names - data.keys()
+        if missing:
+            raise Exception(f"Fields {sorted(missing)} are required in {self.node_id} but not present")
+        _data = {k: data.pop(k) for k in self._field_names & data.keys()}
 
         if self.action_source == AIAction.FUNC:
             try:
@@ -342,9 +421,11 @@ class AIAction:
             except Exception as e:
                 return "", e
         elif self.action_source == AIAction.JTYPE:
-            fn_out = copy.deepcopy(self.fn)
+            fn_out = _clone_spines(self._skeleton, self._spine_paths)
+            rendered = []
             for raw, t, keys in self.templates:
                 value = t.render(**_data)
+                rendered.append(value)
                 put_value_by_keys(fn_out, keys, value)
 
         # print(">> model_params:", self.model_params)
@@ -352,13 +433,66 @@ class AIAction:
         model_final_params = {**self.model_params}
         model_final_params.update(data)
         model_final_params.update(fn_out)  # type: ignore
+
+        # identical calls can be served from the response cache when it is enabled, secrets are not part of the key
+        cache = get_response_cache()
+        if cache is not None:
+            key = response_cache_key(self.model.id, {k: v for k, v in model_final_params.items() if k not in self.model.secret_names})
+            out = cache.get(key)
+            if out is not None:
+                return out, None
+
+        # the static parts of the prompt are the same for the node, so only the rendered templates are compared
+        sim_group = None
+        if self.similarity_threshold and self.action_source == AIAction.JTYPE:
+            sim_group = response_cache_key(
+                self.node_id,
+                {k: v for k, v in model_final_params.items() if k not in self.model.secret_names and k not in fn_out},  # type: ignore
+            )
+            sim_sketch = text_sketch("\n".join(rendered))
+            out = get_similarity_cache().get(sim_group, sim_sketch, self.similarity_threshold)
+            if out is not None:
+                return out, None
+
         out, err = self.model(model_final_params)
         if err != None:
             return "", err
 
+        if cache is not None:
+            cache[key] = out
+        if sim_group is not None:
+            get_similarity_cache().set(sim_group, sim_sketch, out)
         return out, err
 
 
+def _clone_spines(obj: Any, paths: List[Tuple]) -> Any:
+    """Copy only the containers that lie on the given paths, everything else in `obj` is shared by reference. Falls
+    back to `copy.deepcopy` if a container on the path is not a dict or a list.
+
+    Args:
+        obj (Any): The nested object to clone
+        paths (List[Tuple]): The locations of the leaves that are going to be overwritten
+
+    Returns:
+        Any: The cloned object
+    """
+    if not paths:
+        return obj
+    if isinstance(obj, dict):
+        out = dict(obj)
+    elif isinstance(obj, list):
+        out = list(obj)
+    else:
+        return copy.deepcopy(obj)
+    children = {}
+    for p in paths:
+        if len(p) > 1:
+            children.setdefault(p[0], []).append(p[1:])
+    for k, sub_paths in children.items():
+        out[k] = _clone_spines(obj[k], sub_paths)
+    return out
+
+
 class AIActionsRegistry:
     """This class is a registry for all the AI actions."""
 
@@ -366,8 +500,12 @@ class AIActionsRegistry:
 
     def __init__(self):
         self.nodes: Dict[str, Node] = {}
-        self.counter: Dict[str, int] = {}
+        self.counter: Dict[str, int] = defaultdict(int)
         self.tags_to_nodes: Dict[str, List[str]] = {}
+        self._dict_cache: Dict[str, Dict[str, Dict[str, Any]]] = {}  # tag -> serialised nodes, reset on register and unregister
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.nodes
 
     def to_action(
         self,
@@ -378,6 +516,7 @@ class AIActionsRegistry:
         outputs: Dict[str, Any],
         node_id: str = "",
         description: str = "",
+        similarity_threshold: float = 0.0,
     ) -> Node:
         """
         function to create an "Action" aka. `chainfury.Node`.
@@ -393,6 +532,8 @@ class AIActionsRegistry:
               and value automatically extracted from the model output at location `(-1, 'b', 'c')`.
             node_id (str, optional): The node id for this action. Defaults to "".
             description (str, optional): The description for this action. Defaults to "".
+            similarity_threshold (float, optional): Serve near duplicate calls from the fuzzy response cache, see
+              `AIAction`. Defaults to 0.
 
         Returns:
             Node: The node object that can be used to create a chain
@@ -407,9 +548,10 @@ class AIActionsRegistry:
             model_params=model_params,
             fn=fn,
             action_name=action_name,
+            similarity_threshold=similarity_threshold,
         )
         if not outputs:
-            output_field = func_to_return_vars(func=ai_action.__call__, returns={"model_output": ()})
+            output_field = cached_func_to_return_vars(func=ai_action.__call__, returns={"model_output": ()})
         else:
             output_field = [Var(type="string", name=k, loc=loc) for k, loc in outputs.items()]
         node = Node(
@@ -432,6 +574,7 @@ class AIActionsRegistry:
         action_name: str = "",
         description: str = "",
         tags: List[str] = [],
+        similarity_threshold: float = 0.0,
     ) -> Node:
         """
         This function will register this action in the local AI registry so it is accesible everywhere. Use this when
@@ -451,6 +594,8 @@ class AIActionsRegistry:
                 and value automatically extracted from the model output at location `(-1, 'b', 'c')`.
             description (str, optional): The description for this action. Defaults to "".
             tags (List[str], optional): The tags for this action. Defaults to [].
+            similarity_threshold (float, optional): Serve near duplicate calls from the fuzzy response cache, see
+                `AIAction`. Defaults to 0.
         """
         logger.debug(f"Registering ai-node '{node_id}'")
         if node_id != AIActionsRegistry.DB_REGISTER and node_id in self.nodes:
@@ -463,6 +608,7 @@ class AIActionsRegistry:
             fn=fn,
             outputs=outputs,
             description=description,
+            similarity_threshold=similarity_threshold,
         )
 
         # this node can be registered in DB
@@ -472,6 +618,7 @@ class AIActionsRegistry:
         # this is just the server instance register
         else:
             self.nodes[node_id] = node
+            self._dict_cache.clear()
             for tag in tags:
                 self.tags_to_nodes[tag] = self.tags_to_nodes.get(tag, []) + [node_id]
         return node
@@ -489,6 +636,7 @@ class AIActionsRegistry:
         node = self.nodes.pop(node_id, None)
         if node is None:
             raise ValueError(f"ai-node '{node_id}' not found")
+        self._dict_cache.clear()
         for tag, nodes in self.tags_to_nodes.items():
             if node_id in nodes:
                 nodes.remove(node_id)
@@ -505,7 +653,8 @@ class AIActionsRegistry:
         return list(self.tags_to_nodes.keys())
 
     def get_nodes(self, tag: str = "") -> Dict[str, Dict[str, Any]]:
-        """Get all the nodes that are registered
+        """Get all the nodes that are registered. The result is cached until the next `register` or `unregister` so it
+        should not be modified.
 
         Args:
             tag (str, optional): The tag to filter the nodes. Defaults to "".
@@ -513,10 +662,10 @@ class AIActionsRegistry:
         Returns:
             Dict[str, Dict[str, Any]]: The dict of nodes
         """
-        items = {k: v.to_dict() for k, v in self.nodes.items()}
-        if tag:
-            items = {k: v for k, v in items.items() if tag in v.get("tags", [])}
-        return items
+        if tag not in self._dict_cache:
+            ids = self.tags_to_nodes.get(tag, []) if tag else self.nodes
+            self._dict_cache[tag] = {k: self.nodes[k].to_dict() for k in ids}
+        return self._dict_cache[tag]
 
     def get(self, node_id: str) -> Optional[Node]:
         """Get the node for the given node id
@@ -527,7 +676,7 @@ class AIActionsRegistry:
         Returns:
             Optional[Node]: The node object
         """
-        self.counter[node_id] = self.counter.get(node_id, 0) + 1
+        self.counter[node_id] += 1
         out = self.nodes.get(node_id, None)
         if out is None:
             raise ValueError(f"ai-node '{node_id}' not found")
@@ -2,10 +2,14 @@ import copy
 import json
 import inspect
 import datetime
+import threading
 import traceback
+import dataclasses
 from pprint import pformat
-from typing import Any, Union, Optional, Dict, List, Tuple, Callable, Generator
+from functools import lru_cache, cached_property
+from typing import Any, Union, Optional, Dict, List, Tuple, Callable, Generator, FrozenSet
 from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import jinja2schema
 from jinja2schema import model as j2sm
@@ -348,6 +352,56 @@ def func_to_return_vars(func, returns: Dict[str, Tuple]) -> List[Var]:
     return ret
 
 
+@lru_cache(maxsize=1024)
+def _func_to_vars_lru(func) -> Tuple[Var, ...]:
+    return tuple(func_to_vars(func))
+
+
+@lru_cache(maxsize=1024)
+def _func_to_return_vars_lru(func, returns: Tuple[Tuple[str, Tuple], ...]) -> Tuple[Var, ...]:
+    return tuple(func_to_return_vars(func, dict(returns)))
+
+
+def cached_func_to_vars(func: object) -> List[Var]:
+    """
+    Same as `func_to_vars` but the introspection is done only once per function. Only the top level `.value` of a `Var`
+    is set later, so shallow copies are returned on every call. Use `_func_to_vars_lru.cache_info()` to inspect the cache.
+
+    Args:
+        func (Callable): The function to extract the signature from.
+
+    Returns:
+        List[Var]: The array of Var objects.
+    """
+    if inspect.ismethod(func):
+        # bound methods are new objects every time, caching them would only keep the instances alive
+        return func_to_vars(func)
+    return [copy.copy(v) for v in _func_to_vars_lru(func)]
+
+
+def cached_func_to_return_vars(func, returns: Dict[str, Tuple]) -> List[Var]:
+    """
+    Same as `func_to_return_vars` but the introspection is done only once per function and `returns`. Only the top level
+    `.value` of a `Var` is set later, so shallow copies are returned on every call. Use `_func_to_return_vars_lru.cache_info()` to
+    inspect the cache.
+
+    Args:
+        func (Callable): The function to extract the signature from.
+        returns (Dict[str, Tuple]): The dictionary of return types.
+
+    Returns:
+        List[Var]: The array of Var objects.
+    """
+    # only the return annotation is used so a bound method is the same as its underlying function
+    func = getattr(func, "__func__", func)
+    key = tuple(returns.items())
+    try:
+        hash(key)
+    except TypeError:
+        return func_to_return_vars(func, returns)
+    return [copy.copy(v) for v in _func_to_return_vars_lru(func, key)]
+
+
 def jinja_schema_to_vars(v) -> Var:
     """
     Converts a Jinja schema to a Var object.
@@ -498,6 +552,36 @@ def get_value_by_keys(obj, keys) -> Any:
     return None
 
 
+def keys_to_getter(keys) -> Callable[[Any], Any]:
+    """Builds a function that does the same lookup as `get_value_by_keys` for fixed `keys`, the keys are normalised
+    once and the object is walked in a loop instead of recursing and slicing the keys on every call.
+
+    Args:
+        keys (Union[str, List[str], Tuple[str, ...]]): The keys. See `extract_jinja_indices` for examples.
+
+    Returns:
+        Callable[[Any], Any]: The function that takes the nested object and returns the value
+    """
+    if not keys:
+        return lambda obj: obj
+    keys = tuple(keys) if isinstance(keys, (list, tuple)) else (keys,)
+
+    def _get(obj):
+        for key in keys:
+            if isinstance(obj, dict):
+                obj = obj.get(key)
+            elif isinstance(obj, (list, tuple)):
+                key = int(key)
+                if not 0 <= key < len(obj):
+                    return None
+                obj = obj[key]
+            else:
+                return None
+        return obj
+
+    return _get
+
+
 def put_value_by_keys(obj, keys, value: Any):
     """Takes in an arbitrary nested object and sets the value at the location specified by the keys.
 
@@ -527,6 +611,23 @@ def put_value_by_keys(obj, keys, value: Any):
             put_value_by_keys(obj[key], keys[1:], value)
 
 
+def inputs_to_dict(data: Any) -> Dict[str, Any]:
+    """Inputs to nodes and chains can be a dict or a dataclass instance, this returns a new dict in both cases. Fields of
+    a dataclass are read shallowly, unlike `dataclasses.asdict` nothing inside them is copied.
+
+    Args:
+        data (Any): The dict or dataclass instance
+
+    Returns:
+        Dict[str, Any]: The inputs as a dict
+    """
+    if isinstance(data, dict):
+        return dict(data)
+    if dataclasses.is_dataclass(data) and not isinstance(data, type):
+        return {f.name: getattr(data, f.name) for f in dataclasses.fields(data)}
+    raise ValueError(f"Invalid data type: {type(data)}, should be a dict or a dataclass instance")
+
+
 #
 # Model: Each model is the processing engine of the AI actions. It is responsible for keeping
 #        the state of each of the wrapped functions for different API calls.
@@ -561,12 +662,22 @@ class Model:
         self.fn = fn
         self.description = description
         self.usage = usage
-        self.vars = func_to_vars(fn)
+        self.vars = cached_func_to_vars(fn)
         self.tags = tags
 
     def __repr__(self) -> str:
         return f"Model('{self.collection_name}', '{self.id}')"
 
+    @cached_property
+    def var_names(self) -> FrozenSet[str]:
+        """Names of all the vars of this model, computed once since `vars` do not change after creation."""
+        return frozenset(v.name for v in self.vars)
+
+    @cached_property
+    def secret_names(self) -> FrozenSet[str]:
+        """Names of the vars that hold secrets eg. API keys, these are never used as cache keys."""
+        return frozenset(v.name for v in self.vars if v.password)
+
     def to_dict(self, no_vars: bool = False) -> Dict[str, Any]:
         """Converts the model to a dictionary.
 
@@ -656,6 +767,9 @@ class Node:
         self.fn = fn
         self.tags = tags
 
+        # the locations of the outputs are fixed, so the lookups into the raw result are built once
+        self._extractors = [(o, keys_to_getter(o.loc)) for o in outputs]
+
     def __repr__(self) -> str:
         out = f"FuryNode{{ ('{self.id}', '{self.type}') ["
         for f in self.fields:
@@ -756,16 +870,18 @@ class Node:
         """
         return cls.from_dict(json.loads(data))
 
-    def __call__(self, data: Dict[str, Any], print_thoughts: bool = False) -> Tuple[Any, Optional[Exception]]:
+    def __call__(self, data: Union[Dict[str, Any], Any], print_thoughts: bool = False) -> Tuple[Any, Optional[Exception]]:
         """Calls the node with the given data.
 
         Args:
-            data (Dict[str, Any]): The data to pass to the node.
+            data (Union[Dict[str, Any], Any]): The data to pass to the node, a dict or a dataclass instance.
             print_thoughts (bool, optional): Whether to print the thoughts of the node, useful for debugging. Defaults to False.
 
         Returns:
             Tuple[Any, Optional[Exception]]: The result of the node and the exception if any.
         """
+        if not isinstance(data, dict):
+            data = inputs_to_dict(data)
         data_keys = set(data.keys())
         template_keys = set([x.name for x in self.fields])
         try:
@@ -783,11 +899,10 @@ class Node:
             # this is where we have to polish this outgoing result into the structure as configured in self.outputs
             # logger.debug("> fnout: ", out)
             # logger.debug("OUTPUTS:", self.outputs)
-            for o in self.outputs:
-                # logger.debug("  OP:", o.name, o._loc)
-                o.set_value(get_value_by_keys(out, o.loc))
-
-            fout = {o.name: o.value for o in self.outputs}
+            fout = {}
+            for o, get in self._extractors:
+                o.set_value(get(out))
+                fout[o.name] = o.value
             if print_thoughts:
                 print("Outputs:\n-------")
                 print(pformat(fout))
@@ -899,6 +1014,22 @@ class Chain:
         for node_id in self.topo_order:
             assert node_id in self.nodes, f"Missing node from an edge: {node_id}"
 
+        # nodes in the same layer do not depend on each other so they can run concurrently
+        self.layers = topological_layers(self.topo_order, self.edges)
+
+        # keys under which the outputs of each node are stored in the IR buffer, built once instead of on every step
+        self._output_keys: Dict[str, List[Tuple[str, str]]] = {
+            node_id: [(o.name, f"{node_id}/{o.name}") for o in node.outputs] for node_id, node in self.nodes.items()
+        }
+
+        # routing for each node, the IR keys it reads from with the field they go to and the names of its fields
+        self._incoming: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        for edge in self.edges:
+            self._incoming[edge.trg_node_id].append((f"{edge.src_node_id}/{edge.src_node_var}", edge.trg_node_var))
+        self._field_names: Dict[str, FrozenSet[str]] = {
+            node_id: frozenset(f.name for f in node.fields) for node_id, node in self.nodes.items()
+        }
+
         # to a dry run to validate everything
         self.to_dict()
 
@@ -1003,42 +1134,56 @@ class Chain:
         Returns:
             Tuple[Dict[str, Any], Dict[str, Any]]: The currrent output and updated thoughts ir buffer.
         """
+        _data = self._node_inputs(node_id, pre_data, full_ir)
+        out, err = self.nodes[node_id](_data, print_thoughts=print_thoughts)
+        yield_dict = self._record_outputs(node_id, out, err, full_ir, thoughts_callback, print_thoughts)
+        return yield_dict, full_ir
+
+    def _node_inputs(self, node_id: str, pre_data: Dict[str, Any], full_ir: Dict[str, Any]) -> Dict[str, Any]:
+        # collect the inputs for the node from the data and the outputs of its parents in the IR buffer
         node = self.nodes[node_id]
-        incoming_edges = list(filter(lambda edge: edge.trg_node_id == node_id, self.edges))
+        field_names = self._field_names[node_id]
 
         # clear out all the nodes that this thing needs into a separate rep
-        logger.debug(f"Processing node: {node_id}")
-        logger.debug(f"Current full_ir: {set(full_ir.keys())}")
+        logger.debug("Processing node: %s", node_id)
+        logger.debug("Current full_ir: %s", full_ir.keys())
         _data = {}
 
         # first check if this node has any fields that are in the data
         all_keys = list(pre_data.keys())
         for k in all_keys:
-            if node.has_field(k):
+            if k in field_names:
                 _data[k] = pre_data[k]  # don't pop this, some things are shared between actions eg. openai_api_key
             elif k.startswith(node.id):
                 _data[k.split("/", 1)[1]] = pre_data.pop(k)  # pop this, it is not needed anymore
 
         # then merge from the ir buffer
-        for edge in incoming_edges:
-            logger.debug(f"Incoming edge: {edge}")
-            req_key = f"{edge.src_node_id}/{edge.src_node_var}"
-            logger.debug(f"Looking for key: {req_key}")
+        for req_key, trg_node_var in self._incoming.get(node_id, ()):
+            logger.debug("Looking for key: %s", req_key)
             # need to check if this information is available in the IR buffer, if it is not then this is an error
             ir_value = pre_data.get(req_key, None) or full_ir.get(req_key, {}).get("value", None)
             if ir_value is None:
                 raise ValueError(f"Missing value for {req_key}")
-            _data[edge.trg_node_var] = ir_value
+            _data[trg_node_var] = ir_value
+        return _data
 
-        # then run the node
-        out, err = node(_data, print_thoughts=print_thoughts)
+    def _record_outputs(
+        self,
+        node_id: str,
+        out: Any,
+        err: Optional[Exception],
+        full_ir: Dict[str, Any],
+        thoughts_callback: Optional[Callable],
+        print_thoughts: bool,
+    ) -> Dict[str, Any]:
+        # write the outputs of the node to the IR buffer and call the callback, always runs on the calling thread
         if err:
             logger.error(f"TRACE: {out}")
             raise err
 
         yield_dict = {}
-        for k, v in out.items():
-            key = f"{node_id}/{k}"
+        for k, key in self._output_keys[node_id]:
+            v = out[k]
             value = {
                 "value": v,
                 "timestamp": datetime.datetime.now().isoformat(),
@@ -1050,18 +1195,17 @@ class Chain:
                 thoughts_callback(thought)
                 if print_thoughts:
                     print(thought)
-
-        return yield_dict, full_ir
+        return yield_dict
 
     def __call__(
         self,
-        data: Union[str, Dict[str, Any]],
+        data: Union[str, Dict[str, Any], Any],
         thoughts_callback: Optional[Callable] = None,
         print_thoughts: bool = False,
     ) -> Tuple[Var, Dict[str, Any]]:
         """
         Runs the chain on the given data. In this function it will run a full dataflow engine along with thoughts buffer
-        and a simple callback system at each step.
+        and a simple callback system at each step. Nodes that do not depend on each other are run concurrently.
 
         Example:
             >>> chain = Chain(...)
@@ -1084,7 +1228,7 @@ class Chain:
         result as above by iterating over the response and getting the last response.
 
         Args:
-            data (Union[str, Dict[str, Any]]): The data to run the chain on.
+            data (Union[str, Dict[str, Any], Any]): The data to run the chain on, a dict or a dataclass instance.
             thoughts_callback (Optional[Callable], optional): The callback function to call at each step. Defaults to None.
             print_thoughts (bool, optional): Whether to print the thoughts buffer at each step. Defaults to False.
             stream (bool, optional): Whether to stream the output or not. Defaults to False.
@@ -1092,10 +1236,11 @@ class Chain:
         Returns:
             Tuple[Var, Dict[str, Any]]: The output of the chain and the thoughts buffer.
         """
-        if not isinstance(data, dict):
-            assert isinstance(data, str), f"Invalid data type: {type(data)}"
+        if isinstance(data, str):
             assert self.sample and self.main_in, "Cannot run a chain without a sample and main_in for string input, please use a dict input"
             data = {self.main_in: data}
+        elif not isinstance(data, dict):
+            data = inputs_to_dict(data)
         _data = copy.deepcopy(self.sample)  # don't corrupt yourself over multiple calls
         _data.update(data)
         data = _data
@@ -1107,14 +1252,27 @@ class Chain:
 
         full_ir = {}
         out = None
-        for node_id in self.topo_order:
-            yield_dict, full_ir = self.step(
-                node_id=node_id,
-                pre_data=data,
-                full_ir=full_ir,
-                print_thoughts=print_thoughts,
-                thoughts_callback=thoughts_callback,
-            )
+        for layer in self.layers:
+            # thoughts are printed in order so the layer is run sequentially when printing. A chain called from inside a
+            # node already holds a pool worker, waiting on the same pool from there can deadlock so it runs inline
+            if len(layer) == 1 or print_thoughts or _on_chain_worker():
+                for node_id in layer:
+                    self.step(
+                        node_id=node_id,
+                        pre_data=data,
+                        full_ir=full_ir,
+                        print_thoughts=print_thoughts,
+                        thoughts_callback=thoughts_callback,
+                    )
+                continue
+
+            # only the nodes run on the pool, the IR buffer and the callback are handled here in the order of the layer
+            # so the callback is never called from another thread
+            inputs = [self._node_inputs(node_id, data, full_ir) for node_id in layer]
+            futures = [_get_chain_executor().submit(self.nodes[node_id], _data) for node_id, _data in zip(layer, inputs)]
+            for node_id, f in zip(layer, futures):
+                out, err = f.result()
+                self._record_outputs(node_id, out, err, full_ir, thoughts_callback, print_thoughts)
 
         if self.main_out:
             out = full_ir.get(self.main_out)["value"]  # type: ignore
@@ -1129,7 +1287,7 @@ class Chain:
 
     def stream(
         self,
-        data: Union[str, Dict[str, Any]],
+        data: Union[str, Dict[str, Any], Any],
         thoughts_callback: Optional[Callable] = None,
         print_thoughts: bool = False,
     ) -> Generator[Tuple[Union[Any, Dict[str, Any]], bool], None, None]:
@@ -1161,7 +1319,7 @@ class Chain:
                 }
 
         Args:
-            data (Union[str, Dict[str, Any]]): The data to run the chain on.
+            data (Union[str, Dict[str, Any], Any]): The data to run the chain on, a dict or a dataclass instance.
             thoughts_callback (Optional[Callable], optional): The callback function to call at each step. Defaults to None.
             print_thoughts (bool, optional): Whether to print the thoughts buffer at each step. Defaults to False.
 
@@ -1169,10 +1327,11 @@ class Chain:
             Generator[Tuple[Union[Any, Dict[str, Any]], bool], None, None]: The intermediate responses and whether the
             response is the final response or not.
         """
-        if not isinstance(data, dict):
-            assert isinstance(data, str), f"Invalid data type: {type(data)}"
+        if isinstance(data, str):
             assert self.sample and self.main_in, "Cannot run a chain without a sample and main_in for string input, please use a dict input"
             data = {self.main_in: data}
+        elif not isinstance(data, dict):
+            data = inputs_to_dict(data)
         _data = copy.deepcopy(self.sample)  # don't corrupt yourself over multiple calls
         _data.update(data)
         data = _data
@@ -1214,6 +1373,41 @@ class NotDAGError(Exception):
     pass
 
 
+@lru_cache(maxsize=1)
+def _get_chain_executor() -> ThreadPoolExecutor:
+    # nodes mostly wait on network calls, so a small shared pool is enough for all the chains in the process
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="fury-chain")
+
+
+def _on_chain_worker() -> bool:
+    return threading.current_thread().name.startswith("fury-chain")
+
+
+def topological_layers(topo_order: List[str], edges: List[Edge]) -> List[List[str]]:
+    """Group the topologically sorted nodes into layers, each node goes in the layer right after the deepest node it
+    depends on. Nodes within a layer keep the order from `topo_order`.
+
+    Args:
+        topo_order (List[str]): The topologically sorted node ids
+        edges (List[Edge]): The edges of the DAG
+
+    Returns:
+        List[List[str]]: The layers of node ids
+    """
+    parents = defaultdict(set)
+    for edge in edges:
+        parents[edge.trg_node_id].add(edge.src_node_id)
+    depth: Dict[str, int] = {}
+    layers: List[List[str]] = []
+    for node_id in topo_order:
+        d = max((depth[p] + 1 for p in parents[node_id]), default=0)
+        depth[node_id] = d
+        if d == len(layers):
+            layers.append([])
+        layers[d].append(node_id)
+    return layers
+
+
 def edge_array_to_adjacency_list(edges: List[Edge]):
     adjacency_lists = {}
     for edge in edges:
@@ -1,7 +1,15 @@
 import os
 import requests
 from functools import lru_cache
-from typing import Dict, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Tuple, List, Optional
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
 
 from chainfury.utils import logger
 from chainfury.base import Chain, Node, Edge
@@ -62,18 +70,33 @@ class Subway:
     Args:
         _url (str): The url to use for the client
         _session (requests.Session): The session to use for the client
+        _parts (Tuple[str, ...], optional): The path segments to append to the url. Defaults to ().
     """
 
-    def __init__(self, _url, _session):
-        self._url = _url.rstrip("/")
+    def __init__(self, _url, _session, _parts=()):
+        self._base = _url.rstrip("/")
         self._session = _session
+        self._parts = tuple(_parts)
+        self._methods = {m: getattr(_session, m) for m in ("get", "post", "put", "patch", "delete")}
+
+    @property
+    def _url(self) -> str:
+        if not self._parts:
+            return self._base
+        return self._base + "/" + "/".join(self._parts)
 
     def __repr__(self):
         return f"<Subway ({self._url})>"
 
     def __getattr__(self, attr: str):
         # https://stackoverflow.com/questions/3278077/difference-between-getattr-vs-getattribute
-        return Subway(f"{self._url}/{attr}", self._session)
+        # skip __init__ and only extend the path, the url is built once in __call__
+        sub = Subway.__new__(Subway)
+        sub._base = self._base
+        sub._session = self._session
+        sub._parts = self._parts + (attr,)
+        sub._methods = self._methods
+        return sub
 
     def u(self, attr: str) -> "Subway":
         """In cases where the api might start with a number you cannot write in python, this method can be used to
@@ -110,12 +133,13 @@ class Subway:
             data ([type], optional): The data to use. Defaults to None.
             params (Dict, optional): The params to use. Defaults to {}.
             _verbose (bool, optional): Whether to print the response or not. Defaults to False.
+            timeout (optional): The requests timeout, either a number or a (connect, read) tuple. Defaults to (3.05, 30).
 
         Returns:
             Tuple[Dict[str, Any], bool]: The response and whether there was an error or not
         """
-        fn = getattr(self._session, method)
-        url = f"{self._url}{trailing}"
+        fn = self._methods.get(method) or getattr(self._session, method)
+        url = self._url + trailing
         if _verbose:
             logger.info(f"Calling {url}")
         items = {}
@@ -125,18 +149,19 @@ class Subway:
             items["data"] = data
         if params:
             items["params"] = params
-        r = fn(url, **items, **kwargs)
+        timeout = kwargs.pop("timeout", (3.05, 30))  # (connect, read) so a stuck server does not block forever
+        r = fn(url, **items, timeout=timeout, **kwargs)
+        content = r.content
         if _verbose:
-            logger.info(r.content.decode())
+            logger.info(content.decode())
         try:
             r.raise_for_status()  # good when server is good
-            return r.json(), False
+            return _json_loads(content), False
         except:
-            return r.content.decode(), True
+            return content.decode(), True
 
 
-@lru_cache(maxsize=1)
-def get_client(prefix: str = "api/v1", url="", token: str = "") -> Subway:
+def get_client(prefix: str = "api/v1", url="", token: str = "", pool_maxsize: int = 64) -> Subway:
     """This function returns a Subway object that can be used to interact with the API.
 
     Example:
@@ -153,6 +178,7 @@ def get_client(prefix: str = "api/v1", url="", token: str = "") -> Subway:
         prefix (str, optional): The prefix to use for the client. Defaults to "api/v1".
         url (str, optional): The url to use for the client or picks from `CF_URL` env var. Defaults to "".
         token (str, optional): The token to use for the client or picks from `CF_TOKEN` env var. Defaults to "".
+        pool_maxsize (int, optional): The maximum number of connections to keep alive per host. Defaults to 64.
 
     Raises:
         ValueError: If no url or token is provided.
@@ -166,24 +192,157 @@ def get_client(prefix: str = "api/v1", url="", token: str = "") -> Subway:
     token = token or os.environ.get("CF_TOKEN", "")
     if not token:
         raise ValueError("No token provided, please set CF_TOKEN environment variable or pass token as argument")
+    return _get_client(prefix, url, token, pool_maxsize)
 
+
+@lru_cache(maxsize=32)
+def _get_client(prefix: str, url: str, token: str, pool_maxsize: int) -> Subway:
+    """Cached builder for `get_client`, keyed on the resolved values so different tenants (url, token) each keep their
+    own pooled session. Use `_get_client.cache_info()` to check the hit ratio.
+    """
+    # mount a pooled adapter so that all the calls made by the Subway reuse the same keep-alive connections
     session = requests.Session()
-    session.headers.update({"token": token})
-    sub = Subway(url, session)
-    for p in prefix.split("/"):
-        sub = getattr(sub, p)
-    return sub
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "PUT", "DELETE"]),  # POST is not idempotent, it can create duplicates
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"token": token, "Connection": "keep-alive"})
+    return Subway(url, session, _parts=tuple(p for p in prefix.split("/") if p))
 
 
-def get_chain_from_dict(data: Dict[str, Any]) -> Chain:
-    stub = get_client()
+@lru_cache(maxsize=512)
+def _fetch_action(cf_id: str) -> Dict[str, Any]:
+    """Load a single action from the API. Actions rarely change within a process so the responses are memoized, use
+    `_fetch_action.cache_info()` to inspect and `_fetch_action.cache_clear()` to reset the cache.
+
+    Note:
+        This returns the raw action and not a `Node` because the caller overrides the id of the node, so a fresh
+        `Node` should be built every time.
+
+    Args:
+        cf_id (str): The id of the action to fetch
+
+    Raises:
+        ValueError: If the action could not be loaded
+
+    Returns:
+        Dict[str, Any]: The action as returned by the API
+    """
+    try:
+        action, err = get_client().fury.actions.u(cf_id)()
+    except Exception as e:
+        raise ValueError(f"Action {cf_id} not found") from e
+    if err:
+        raise ValueError(f"Action {cf_id} not loaded: {action}")
+    return action
+
+
+_MAX_BULK_IDS = 100
+
+
+@lru_cache(maxsize=128)
+def _fetch_actions_bulk(cf_ids: Tuple[str, ...]) -> Dict[str, Dict[str, Any]]:
+    """Load all the actions in a single call to the list API. Only successful results are cached, any failure is
+    raised so that a transient error does not disable the bulk path for these ids.
+
+    Args:
+        cf_ids (Tuple[str, ...]): The ids of the actions to fetch
+
+    Raises:
+        ValueError: If the server returned an error or an unexpected response
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The map between the cf_id and the action
+    """
+    out, err = get_client().fury.actions("get", trailing="/", params={"ids": ",".join(cf_ids)})
+    if err or not isinstance(out, list):
+        raise ValueError(f"Bulk fetch of actions failed: {out}")
+    wanted = set(cf_ids)
+    return {x["id"]: x for x in out if isinstance(x, dict) and x.get("id") in wanted}
+
+
+def _fetch_actions(cf_ids: List[str], max_workers: int = 32) -> Dict[str, Dict[str, Any]]:
+    """Fetch all the actions with the given ids from the API. When there is more than one action they are first
+    requested in a single bulk call, anything that is still missing is then fetched one by one. These calls are I/O
+    bound so they are issued concurrently over the same pooled session.
+
+    Args:
+        cf_ids (List[str]): The ids of the actions to fetch
+        max_workers (int, optional): The maximum number of concurrent calls. Defaults to 32.
+
+    Raises:
+        ValueError: If any of the actions could not be loaded
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The map between the cf_id and the action
+    """
+    if not cf_ids:
+        return {}
+    actions_map = {}
+    if len(cf_ids) > 1:
+        # the server accepts at most `_MAX_BULK_IDS` ids in one call
+        for i in range(0, len(cf_ids), _MAX_BULK_IDS):
+            try:
+                actions_map.update(_fetch_actions_bulk(tuple(cf_ids[i : i + _MAX_BULK_IDS])))
+            except Exception as e:
+                # whatever is missing is fetched one by one below
+                logger.debug(f"Bulk fetch of actions failed: {e}")
+    remaining = [x for x in cf_ids if x not in actions_map]
+    if len(remaining) == 1:
+        actions_map[remaining[0]] = _fetch_action(remaining[0])
+    elif remaining:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(remaining))) as exe:
+            actions_map.update(zip(remaining, exe.map(_fetch_action, remaining)))
+    return actions_map
+
+
+def _construct_dag(data: Dict[str, Any]) -> Dag:
+    """Build the `Dag` without running the pydantic validation, only use this for payloads coming from the server.
+
+    Args:
+        data (Dict[str, Any]): The DAG as stored on the server
+
+    Returns:
+        Dag: The DAG object
+    """
+    nodes = []
+    for node in data.get("nodes", []):
+        node = {**node}
+        if node.get("cf_data"):
+            node["cf_data"] = FENode.CFData.construct(**node["cf_data"])
+        for k in ("position", "position_absolute"):
+            if node.get(k):
+                node[k] = FENode.Position.construct(**node[k])
+        nodes.append(FENode.construct(**node))
+    edges = [EdgeType.construct(**e) for e in data.get("edges", [])]
+    return Dag.construct(**{**data, "nodes": nodes, "edges": edges})
+
 
+def get_chain_from_dict(data: Dict[str, Any], trusted: bool = False) -> Chain:
+    """Helper function to build a chain from the DAG dict.
+
+    Args:
+        data (Dict[str, Any]): The DAG dict
+        trusted (bool, optional): If the data comes from the server, skip the pydantic validation. Defaults to False.
+
+    Returns:
+        Chain: The chain object
+    """
     # convert to dag and checks
     nodes = []
     edges = []
 
     # convert to dag and checks
-    dag = Dag(**data)
+    dag = _construct_dag(data) if trusted else Dag(**data)
     if not dag.sample:
         raise ValueError("Dag has no sample")
     if not dag.main_in:
@@ -191,55 +350,43 @@ def get_chain_from_dict(data: Dict[str, Any]) -> Chain:
     if not dag.main_out:
         raise ValueError("Dag has no main_out")
 
-    # get all the actions by querying the APIs
+    # get all the actions by querying the APIs, first collect all the actions that are neither in the registries
+    # nor sent along with the DAG and fetch them together so the loop below only does local lookups
     dag_nodes = dag.nodes
-    actions_map = {}  # this is the map between the cf_id and the node object
+    missing_ids = []
     for node in dag_nodes:
         if not node.cf_id and not node.cf_data:
             raise ValueError(f"Action {node.id} has no cf_id or cf_data")
+        if node.cf_data or node.cf_id in missing_ids:
+            continue
+        if node.cf_id in ai_actions_registry or node.cf_id in programatic_actions_registry:
+            continue
+        missing_ids.append(node.cf_id)
+    actions_map = _fetch_actions(missing_ids)  # this is the map between the cf_id and the action
+
+    for node in dag_nodes:
+        # every branch below produces a Node directly
+        cf_action: Optional[Node] = None
         if node.cf_data:
             # programmatic ones should always be picked from the registry also FE will always send this
             # so server should always check for programatic ones via registry
             if node.cf_data.type == Node.types.PROGRAMATIC:
-                try:
-                    cf_action = programatic_actions_registry.get(node.cf_id)
-                except ValueError:
+                if node.cf_id not in programatic_actions_registry:
                     raise ValueError(f"Action {node.id} not found")
+                cf_action = programatic_actions_registry.get(node.cf_id)
             else:
                 cf_action = Node.from_dict(node.cf_data.node)
-        else:
-            cf_action = actions_map.get(node.cf_id, None)
 
-        # check if this action is in the registry
-        if not cf_action:
-            # check if present in the AI registry
-            try:
-                # print("ai_actions_registry")
-                cf_action = ai_actions_registry.get(node.cf_id)
-            except ValueError:
-                pass
-        if not cf_action:
-            # check if present in the programatic registry
-            try:
-                # print("programatic_actions_registry")
-                cf_action = programatic_actions_registry.get(node.cf_id)
-            except ValueError:
-                pass
-        if not cf_action:
-            # check available on the API
-            try:
-                # print("stub.fury.actions.u(node.cf_id)()")
-                action, err = stub.fury.actions.u(node.cf_id)()
-                if err:
-                    raise ValueError(f"Action {node.cf_id} not loaded: {action}")
-                cf_action = Node.from_dict(action)
-                actions_map[node.cf_id] = cf_action  # cache it
-            except:
-                raise ValueError(f"Action {node.cf_id} not found")
-
-        # standardsize everything to node
-        if not isinstance(cf_action, Node):
-            cf_action = Node.from_dict(cf_action)
+        # check if this action is in the registries, `get` returns a copy so the id can be overriden below
+        elif node.cf_id in ai_actions_registry:
+            cf_action = ai_actions_registry.get(node.cf_id)
+        elif node.cf_id in programatic_actions_registry:
+            cf_action = programatic_actions_registry.get(node.cf_id)
+        elif node.cf_id in actions_map:
+            cf_action = Node.from_dict(actions_map[node.cf_id])
+        if cf_action is None:
+            raise ValueError(f"Action {node.cf_id} not found")
+
         cf_action.id = node.id  # override the id
         nodes.append(cf_action)
 
@@ -278,10 +425,20 @@ def get_chain_from_id(id: str) -> Chain:
     chain, err = stub.chatbot.u(id)()
     if err:
         raise ValueError(f"Could not get chain with id {id}: {chain}")
-    out = get_chain_from_dict(chain["dag"])
+    out = get_chain_from_dict(chain["dag"], trusted=True)
     return out
 
 
+# the fields that are the same for every `FENode` created by `create_new_chain`
+_FE_NODE_TEMPLATE = {
+    "type": "FuryEngineNode",
+    "width": 100,
+    "height": 100,
+    "selected": False,
+    "dragging": False,
+}
+
+
 def create_new_chain(name: str, chain: Chain) -> Dict[str, Any]:
     """
     Creates a new chain with the given name and chain. If create_actions is True, it will also create the actions
@@ -306,16 +463,14 @@ def create_new_chain(name: str, chain: Chain) -> Dict[str, Any]:
     chain_dict = chain.to_dict()
     nodes = chain_dict["nodes"]
     dag_nodes = []
-    for i, node in enumerate(chain.nodes.values()):
-        _node_data = FENode(
+    for i, (node, node_dict) in enumerate(zip(chain.nodes.values(), nodes)):
+        xy = float(i * 100)
+        _node_data = _FE_NODE_TEMPLATE.copy()
+        _node_data.update(
             id=node.id,
-            position=FENode.Position(x=i * 100, y=i * 100),
-            type="FuryEngineNode",
-            width=100,
-            height=100,
-            selected=False,
-            position_absolute=FENode.Position(x=i * 100, y=i * 100),
-            dragging=False,
+            position={"x": xy, "y": xy},
+            position_absolute={"x": xy, "y": xy},
+            data={},
         )
 
         # out, err = stub.fury.actions(
@@ -335,32 +490,32 @@ def create_new_chain(name: str, chain: Chain) -> Dict[str, Any]:
         # if err:
         #     raise ValueError(f"Could not create node: {out}")
         # logger.info(f"Created new action with ID: {out['id']}")
-        # _node_data.cf_id = out["id"]
-
-        # in this case the entire action is stored with the DAG object
-        _node_data.cf_id = node.id
-        _node_data.cf_data = FENode.CFData(
-            id=node.id,
-            type=node.type,
-            node=node.to_dict(),
-            value=None,
-        )
+        # _node_data["cf_id"] = out["id"]
+
+        # in this case the entire action is stored with the DAG object, chain.to_dict() has already serialised it
+        _node_data["cf_id"] = node.id
+        _node_data["cf_data"] = {
+            "id": node.id,
+            "type": node.type,
+            "node": node_dict,
+            "value": None,
+        }
 
         # add the node to the list
-        dag_nodes.append(_node_data.dict())
+        dag_nodes.append(_node_data)
     chain_dict["nodes"] = dag_nodes
 
     # update the chain_dict
     edges = []
     for e in chain.edges:
         edges.append(
-            EdgeType(
-                id=f"{e.src_node_id}/{e.src_node_var}-{e.trg_node_id}/{e.trg_node_var}",
-                source=e.src_node_id,
-                sourceHandle=e.src_node_var,
-                target=e.trg_node_id,
-                targetHandle=e.trg_node_var,
-            ).dict()
+            {
+                "id": "%s/%s-%s/%s" % (e.src_node_id, e.src_node_var, e.trg_node_id, e.trg_node_var),
+                "source": e.src_node_id,
+                "sourceHandle": e.src_node_var,
+                "target": e.trg_node_id,
+                "targetHandle": e.trg_node_var,
+            }
         )
     chain_dict["edges"] = edges
     data = {"name": name, "dag": chain_dict, "engine": "fury"}
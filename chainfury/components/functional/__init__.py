@@ -7,6 +7,9 @@ unique components into programatic_action_registry.
 import re
 import json
 import requests
+from functools import lru_cache
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from typing import Any, List, Dict, Tuple, Optional, Union
 
 from chainfury import programatic_actions_registry, exponential_backoff
@@ -17,6 +20,20 @@ from chainfury.base import get_value_by_keys
 _VALID_HTTP_METHODS = ["GET", "POST", "PUT", "DELETE", "PATCH"]
 
 
+class _NoStoreCookiePolicy(DefaultCookiePolicy):
+    # the session is shared by all the calls, so never keep cookies set by one response around for the next call
+    def set_ok(self, cookie, request):
+        return False
+
+
+# one session per process so repeated calls to the same host re-use the keep-alive connections, retries are
+# handled by exponential_backoff below
+_SESSION = requests.Session()
+_SESSION.cookies.set_policy(_NoStoreCookiePolicy())
+_SESSION.mount("http://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+
+
 def call_api_requests(
     method: str,
     url: str,
@@ -53,19 +70,18 @@ def call_api_requests(
         raise ValueError(f"method must be one of {_VALID_HTTP_METHODS}")
 
     def _fn():
-        with requests.Session() as sess:
-            out = sess.request(
-                method,
-                url,
-                params=params,
-                data=data,
-                headers=headers,
-                cookies=cookies,
-                auth=auth,  # type: ignore
-                timeout=None if not timeout else timeout,
-                allow_redirects=True,
-                json=json,
-            )
+        out = _SESSION.request(
+            method,
+            url,
+            params=params,
+            data=data,
+            headers=headers,
+            cookies=cookies,
+            auth=auth,  # type: ignore
+            timeout=None if not timeout else timeout,
+            allow_redirects=True,
+            json=json,
+        )
         return out.text, out.status_code
 
     text, status_code = exponential_backoff(foo=_fn, max_retries=max_retries, retry_delay=retry_delay)
@@ -86,6 +102,12 @@ programatic_actions_registry.register(
 # a few functions that do regex things
 
 
+@lru_cache(maxsize=1024)
+def _compile(pattern: str) -> re.Pattern:
+    # patterns are mostly fixed in a chain, so compile them once instead of going through `re`'s internal cache
+    return re.compile(pattern)
+
+
 def regex_search(pattern: str, text: str) -> Tuple[List[str], Optional[Exception]]:
     """
     Perform a regex search on the text and get items in an array
@@ -98,7 +120,7 @@ def regex_search(pattern: str, text: str) -> Tuple[List[str], Optional[Exception
         Tuple[List[str], Optional[Exception]]: The list of items found
     """
     try:
-        out = re.findall(pattern, text)
+        out = _compile(pattern).findall(text)
         return out, None
     except Exception as e:
         return [], e
@@ -125,7 +147,7 @@ def regex_substitute(pattern: str, repl: str, text: str) -> Tuple[str, Optional[
         Tuple[str, Optional[Exception]]: The substituted text and the exception if there was one
     """
     try:
-        out = re.sub(pattern, repl, text)
+        out = _compile(pattern).sub(repl, text)
         return out, None
     except Exception as e:
         return "", e
@@ -1,9 +1,33 @@
+import sys
 import requests
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
 from typing import Any, List, Union, Dict
 
 from chainfury import Secret, model_registry, exponential_backoff, Model, UnAuthException
 from chainfury.components.const import Env
 
+try:
+    import orjson
+    from orjson import loads as _json_loads
+
+    def _json_dumps(obj: Any) -> bytes:
+        # `logit_bias` is keyed by token ids, so int keys have to be allowed
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+except ImportError:
+    from json import dumps as _json_dumps, loads as _json_loads
+
+
+@lru_cache(maxsize=4)
+def _get_session(openai_api_key: str) -> requests.Session:
+    # all the calls go to the same host, so nodes in a chain share one keep-alive pool per key instead of paying a
+    # fresh TCP + TLS handshake on every call
+    sess = requests.Session()
+    sess.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=20))
+    sess.headers.update({"Content-Type": "application/json", "Authorization": f"Bearer {openai_api_key}"})
+    return sess
+
 
 def openai_completion(
     model: str,
@@ -66,34 +90,32 @@ def openai_completion(
         raise Exception("OpenAI API key not found. Please set OPENAI_TOKEN environment variable or pass through function")
 
     def _fn():
-        r = requests.post(
+        r = _get_session(str(openai_api_key)).post(
             "https://api.openai.com/v1/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {openai_api_key}",
-            },
-            json={
-                "model": model,
-                "prompt": prompt,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-                "n": n,
-                "logprobs": logprobs,
-                "echo": echo,
-                "stop": stop,
-                "presence_penalty": presence_penalty,
-                "frequency_penalty": frequency_penalty,
-                "best_of": best_of,
-                "logit_bias": logit_bias,
-                "user": user,
-            },
+            data=_json_dumps(
+                {
+                    "model": model,
+                    "prompt": prompt,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "n": n,
+                    "logprobs": logprobs,
+                    "echo": echo,
+                    "stop": stop,
+                    "presence_penalty": presence_penalty,
+                    "frequency_penalty": frequency_penalty,
+                    "best_of": best_of,
+                    "logit_bias": logit_bias,
+                    "user": user,
+                }
+            ),
         )
         if r.status_code == 401:
             raise UnAuthException(r.text)
         if r.status_code != 200:
             raise Exception(f"OpenAI API returned status code {r.status_code}: {r.text}")
-        return r.json()
+        return _json_loads(r.content)
 
     return exponential_backoff(_fn, max_retries=retry_count, retry_delay=retry_delay)
 
@@ -122,6 +144,7 @@ def openai_chat(
     frequency_penalty: float = 0.0,
     logit_bias: dict = {},
     user: str = "",
+    stream: bool = False,
     *,
     retry_count: int = 3,
     retry_delay: int = 1,
@@ -145,6 +168,7 @@ def openai_chat(
         frequency_penalty: Optional. Number between -2.0 and 2.0. Positive values penalize new tokens based on their existing frequency in the text so far, decreasing the model's likelihood to repeat the same line verbatim. See more information about frequency and presence penalties. Defaults to 0.
         logit_bias: Optional. Modify the likelihood of specified tokens appearing in the completion. Accepts a json object that maps tokens (specified by their token ID in the tokenizer) to an associated bias value from -100 to 100. Mathematically, the bias is added to the logits generated by the model prior to sampling. The exact effect will vary per model, but values between -1 and 1 should decrease or increase likelihood of selection; values like -100 or 100 should result in a ban or exclusive selection of the relevant
         user: Optional. A unique identifier representing your end-user, which can help OpenAI to monitor and detect abuse. Defaults to None.
+        stream: Optional. If set, tokens of the first choice are written to stdout as they arrive, the returned object has the same `choices` structure with the full message. Defaults to False.
 
     Returns:
         Any: The completion(s) generated by the API.
@@ -155,33 +179,58 @@ def openai_chat(
         raise Exception("OpenAI API key not found. Please set OPENAI_TOKEN environment variable or pass through function")
 
     def _fn():
-        r = requests.post(
+        r = _get_session(str(openai_api_key)).post(
             "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {openai_api_key}",
-            },
-            json={
-                "model": model,
-                "messages": messages,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-                "n": n,
-                "stop": stop,
-                "presence_penalty": presence_penalty,
-                "frequency_penalty": frequency_penalty,
-                "logit_bias": logit_bias,
-                "user": user,
-            },
+            data=_json_dumps(
+                {
+                    "model": model,
+                    "messages": messages,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "n": n,
+                    "stop": stop,
+                    "presence_penalty": presence_penalty,
+                    "frequency_penalty": frequency_penalty,
+                    "logit_bias": logit_bias,
+                    "user": user,
+                    "stream": stream,
+                }
+            ),
+            stream=stream,
         )
         if r.status_code == 401:
             raise UnAuthException(r.text)
         if r.status_code != 200:
             raise Exception(f"OpenAI API returned status code {r.status_code}: {r.text}")
-        return r.json()
-
-    return exponential_backoff(_fn, max_retries=retry_count, retry_delay=retry_delay)
+        if stream:
+            return r
+        return _json_loads(r.content)
+
+    out = exponential_backoff(_fn, max_retries=retry_count, retry_delay=retry_delay)
+    if not stream:
+        return out
+
+    # server sent events, only the content of the first choice is printed and collected
+    role, content = "assistant", []
+    with out:
+        for line in out.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            line = line[6:]
+            if line == b"[DONE]":
+                break
+            choices = _json_loads(line)["choices"]
+            if not choices or choices[0]["index"] != 0:
+                continue
+            delta = choices[0]["delta"]
+            role = delta.get("role", role)
+            if delta.get("content"):
+                sys.stdout.write(delta["content"])
+                sys.stdout.flush()
+                content.append(delta["content"])
+    sys.stdout.write("\n")
+    return {"choices": [{"index": 0, "message": {"role": role, "content": "".join(content)}}]}
 
 
 model_registry.register(
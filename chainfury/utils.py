@@ -1,7 +1,19 @@
 import os
+import json
 import time
+import zlib
+import heapq
+import hashlib
 import logging
-from typing import Any, Dict
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def terminal_top_with_text(msg: str = "") -> str:
@@ -80,3 +92,146 @@ def exponential_backoff(foo, *args, max_retries=2, retry_delay=1, **kwargs) -> D
                 logger.info(f"Retrying in {delay} seconds...")
                 time.sleep(delay)  # Wait for the calculated delay
     raise Exception("This should never happen")
+
+
+class _MemoryCache:
+    """Bounded in-process LRU with the same `get` / `__setitem__` surface as `diskcache.Cache`"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()  # nodes in a chain layer call the actions from several threads
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> Optional[Any]:
+    """Returns the cache for model responses, it is disabled unless `FURY_CACHE_DIR` is set. Uses `diskcache` at that
+    location if it is installed otherwise falls back to an in-process LRU.
+
+    Returns:
+        Optional[Any]: The cache object or None if caching is disabled
+    """
+    cache_dir = os.getenv("FURY_CACHE_DIR", "")
+    if not cache_dir:
+        return None
+    try:
+        import diskcache
+    except ImportError:
+        logger.warning("diskcache is not installed, model responses will only be cached in memory")
+        return _MemoryCache()
+    return diskcache.Cache(os.path.expanduser(cache_dir), size_limit=2**31)
+
+
+def response_cache_key(model_id: str, params: Dict[str, Any]) -> str:
+    """Exact match key for a model call, the hash of the model id and the fully rendered params
+
+    Args:
+        model_id (str): The id of the model
+        params (Dict[str, Any]): The final params that are passed to the model, without any secrets
+
+    Returns:
+        str: The hex digest
+    """
+    obj = {"model": model_id, "params": params}
+    blob = None
+    if orjson is not None:
+        try:
+            blob = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+        except TypeError:
+            pass  # eg. keys of mixed types cannot be sorted, use the stdlib below
+    if blob is None:
+        blob = json.dumps(obj, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()
+
+
+# near duplicate detection works on a bottom-k MinHash sketch of the byte shingles of a text, comparing two sketches
+# costs O(k) however long the texts are
+_SHINGLE_SIZE = 8
+_SKETCH_SIZE = 128
+_SKETCH_MAX_BYTES = 1 << 17
+
+
+def text_sketch(text: str) -> Tuple[int, ...]:
+    """Bottom-k MinHash sketch of `text`, the hashes are stable across processes so sketches can be stored on disk.
+    Only the first 128KB of the text are used.
+
+    Args:
+        text (str): The text to sketch
+
+    Returns:
+        Tuple[int, ...]: The `_SKETCH_SIZE` smallest shingle hashes, sorted
+    """
+    data = text.encode()[:_SKETCH_MAX_BYTES]
+    n = max(len(data) - _SHINGLE_SIZE + 1, 1)
+    hashes = {zlib.crc32(data[i : i + _SHINGLE_SIZE]) for i in range(n)}
+    return tuple(heapq.nsmallest(_SKETCH_SIZE, hashes))
+
+
+def sketch_similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the shingles of the texts behind two sketches from `text_sketch`
+
+    Args:
+        a (Tuple[int, ...]): The first sketch
+        b (Tuple[int, ...]): The second sketch
+
+    Returns:
+        float: The similarity between 0 and 1
+    """
+    sa, sb = set(a), set(b)
+    union = heapq.nsmallest(_SKETCH_SIZE, sa | sb)
+    if not union:
+        return 1.0
+    return sum(1 for h in union if h in sa and h in sb) / len(union)
+
+
+class SimilarityCache:
+    """Fuzzy tier for the response cache. Entries are grouped by an exact key of everything that is not free text, a
+    lookup returns the value of the most similar sketch in the group if the estimated similarity is at least
+    `threshold`. There is no embedding model behind this so it only catches near duplicate texts, not paraphrases.
+
+    Args:
+        store (Any): Where the groups are kept, anything with `get` and `__setitem__` eg. `diskcache.Cache`
+        group_size (int, optional): The maximum number of texts kept per group. Defaults to 64.
+    """
+
+    def __init__(self, store: Any, group_size: int = 64):
+        self.store = store
+        self.group_size = group_size
+        self._lock = threading.Lock()
+
+    def get(self, group: str, sketch: Tuple[int, ...], threshold: float) -> Optional[Any]:
+        best, best_sim = None, threshold
+        for s, value in self.store.get("similarity/" + group) or ():
+            sim = sketch_similarity(sketch, s)
+            if sim >= best_sim:
+                best, best_sim = value, sim
+        return best
+
+    def set(self, group: str, sketch: Tuple[int, ...], value: Any):
+        key = "similarity/" + group
+        with self._lock:
+            entries = list(self.store.get(key) or ())
+            entries.append((sketch, value))
+            self.store[key] = entries[-self.group_size :]
+
+
+@lru_cache(maxsize=1)
+def get_similarity_cache() -> SimilarityCache:
+    """Returns the fuzzy response cache, it is kept next to the response cache when `FURY_CACHE_DIR` is set so it
+    persists across processes, otherwise it lives in memory."""
+    store = get_response_cache()
+    return SimilarityCache(_MemoryCache(maxsize=256) if store is None else store)
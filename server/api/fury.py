@@ -285,6 +285,9 @@ def delete_fury_action(
 
 
 # L - List all FuryActions
+MAX_BULK_IDS = 100
+
+
 @fury_router.get("/actions/")
 def list_fury_actions(
     req: Request,
@@ -292,12 +295,22 @@ def list_fury_actions(
     token: Annotated[str, Header()],
     offset: int = Query(0, ge=0),
     limit: int = Query(25, ge=1, le=25),
+    ids: str = Query("", description="Comma separated list of action IDs to fetch in a single call."),
     db: Session = Depends(fastapi_db_session),
 ):
     # validate user
     username = get_user_from_jwt(token)
     user = verify_user(db, username)
 
+    # bulk read, this is used by the clients to load all the actions of a chain in one call
+    if ids:
+        id_list = [x for x in ids.split(",") if x]
+        if len(id_list) > MAX_BULK_IDS:
+            resp.status_code = 400
+            return {"error": f"At most {MAX_BULK_IDS} ids can be fetched in a single call"}
+        fury_actions = db.query(FuryActions).filter(FuryActions.id.in_(id_list)).all()
+        return fury_actions
+
     # read from db
     fury_actions = db.query(FuryActions).offset(offset).limit(limit).all()
     return fury_actions
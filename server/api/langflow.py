@@ -1,4 +1,10 @@
-from fastapi import APIRouter
+import json
+import hashlib
+from functools import lru_cache
+from typing import Tuple
+
+from fastapi import APIRouter, Request, Response
+from fastapi.encoders import jsonable_encoder
 from langflow.interface.types import build_langchain_types_dict
 
 from commons import config as c
@@ -14,6 +20,18 @@ router.__doc__ = """
 """
 
 
+@lru_cache(maxsize=1)
+def _types_dict() -> Tuple[bytes, str]:
+    # the types dict is static for a process, so serialize it and compute the ETag only once
+    content = json.dumps(jsonable_encoder(build_langchain_types_dict())).encode()
+    etag = '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+    return content, etag
+
+
 @router.get("/components")
-def get_all():
-    return build_langchain_types_dict()
+def get_all(req: Request):
+    content, etag = _types_dict()
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    if req.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
@@ -1,20 +1,27 @@
 import os
+import re
 import json
-import fire
+import logging
+from functools import lru_cache
+from dataclasses import dataclass, field, asdict
 from pprint import pformat
-from requests import Session
-from typing import Dict, Any
+from typing import Dict, Any, List
 
-from chainfury import (
-    Chain,
-    programatic_actions_registry,
-    model_registry,
-    Node,
-    ai_actions_registry,
-    Edge,
-)
+# chainfury is imported inside the commands so that `help` and the CLI discovery do not pay for loading the package
+# and registering all the components
 
 
+log = logging.getLogger("stories.fury")
+
+
+def _set_verbose(verbose: bool):
+    # only this logger is made verbose, the package and its dependencies keep their own levels
+    if verbose and not log.handlers:
+        log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.DEBUG if verbose else logging.WARNING)
+
+
+@lru_cache(maxsize=1)
 def _get_openai_token() -> str:
     openai_token = os.environ.get("OPENAI_TOKEN", "")
     if not openai_token:
@@ -22,18 +29,112 @@ def _get_openai_token() -> str:
     return openai_token
 
 
+@dataclass(frozen=True)
+class ApiCallInput:
+    method: str
+    url: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    timeout: float = 10.0
+
+
+_NUMBERED_ANSWER = re.compile(r"^A(\d+):\s*", re.MULTILINE)
+
+
+def _parse_numbered(text: str, k: int) -> List[str]:
+    """Split a batch reply of the form `A1: ...\nA2: ...` into a list of `k` answers, missing ones are empty"""
+    out = [""] * k
+    parts = _NUMBERED_ANSWER.split(text)
+    for idx, ans in zip(parts[1::2], parts[2::2]):
+        i = int(idx) - 1
+        if 0 <= i < k:
+            out[i] = ans.strip()
+    return out
+
+
+@lru_cache(maxsize=1)
+def _build_callj3_chain():
+    """The callj3 chain is the same for every quote, so it is built once per process and only the inputs change"""
+    from chainfury import Chain, Edge, ai_actions_registry
+
+    if "find-quote" in ai_actions_registry:
+        findQuote = ai_actions_registry.get("find-quote")
+    else:
+        findQuote = ai_actions_registry.register(
+            node_id="find-quote",
+            model_id="openai-chat",
+            model_params={
+                "model": "gpt-3.5-turbo",
+            },
+            fn={
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": "Who said this quote, if you don't know then reply with a random character from history world? Give reply in less than 10 words.\n\nQuote: '{{ quote }}'",
+                    },
+                ],
+            },
+            outputs={
+                "chat_reply": ("choices", 0, "message", "content"),
+            },
+        )
+
+    if "tell-character-story" in ai_actions_registry:
+        charStory = ai_actions_registry.get("tell-character-story")
+    else:
+        charStory = ai_actions_registry.register(
+            node_id="tell-character-story",
+            model_id="openai-chat",
+            model_params={
+                "model": "gpt-3.5-turbo",
+            },
+            fn={
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": "Tell a small story about a character.\nLength: {{ story_size }} lines\nCharacter: '{{ character_name }}'",
+                    },
+                ],
+            },
+            outputs={
+                "characters_story": ("choices", 0, "message", "content"),
+            },
+        )
+
+    rapMaker = ai_actions_registry.get("deep-rap-quote")
+    summary_keys = {
+        findQuote.id: f"{findQuote.id}/chat_reply",
+        charStory.id: f"{charStory.id}/characters_story",
+        rapMaker.id: f"{rapMaker.id}/chat_reply",
+    }
+    e1 = Edge(findQuote.id, "chat_reply", charStory.id, "character_name")
+    e2 = Edge(charStory.id, "characters_story", rapMaker.id, "character")
+    c = Chain(
+        [findQuote, charStory, rapMaker],
+        [e1, e2],
+        sample={"quote": ""},
+        main_in="quote",
+        main_out=f"{rapMaker.id}/chat_reply",
+    )
+    return c, summary_keys
+
+
 class _Nodes:
+    def __init__(self, verbose: bool = False):
+        _set_verbose(verbose)
+
     def callp(self, fail: bool = False):
         """Call a programatic action"""
+        from chainfury import programatic_actions_registry
+
         node = programatic_actions_registry.get("call_api_requests")
-        print("NODE:", node)
-        data = {
-            "method": "get",
-            "url": "http://127.0.0.1:8000/api/v1/fury/components/",
-            "headers": {"token": "my-booomerang-token"},
-        }
+        log.debug("NODE: %s", node)
+        data = ApiCallInput(
+            method="get",
+            url="http://127.0.0.1:8000/api/v1/fury/components/",
+            headers={"token": "my-booomerang-token"},
+        )
         if fail:
-            data["some-key"] = "some-value"
+            data = {**asdict(data), "some-key": "some-value"}
         out, err = node(data)
         if err:
             print("ERROR:", err)
@@ -43,8 +144,10 @@ class _Nodes:
 
     def callm(self, fail: bool = False):
         """Call a model"""
+        from chainfury import model_registry
+
         model = model_registry.get("openai-completion")
-        print("Found model:", model)
+        log.debug("Found model: %s", model)
         data = {
             "openai_api_key": _get_openai_token(),
             "model": "text-curie-001",
@@ -61,6 +164,8 @@ class _Nodes:
 
     def callai(self, fail: bool = False):
         """Call the AI action"""
+        from chainfury import ai_actions_registry
+
         if fail:
             action_id = "write-a-poem"
         else:
@@ -84,9 +189,11 @@ class _Nodes:
 
     def callai_chat(self, character: str = "a mexican taco"):
         """Call the AI action"""
+        from chainfury import ai_actions_registry
+
         action_id = "deep-rap-quote"
         action = ai_actions_registry.get(action_id)
-        print("ACTION:", action)
+        log.debug("ACTION: %s", action)
 
         out, err = action(
             {
@@ -102,12 +209,17 @@ class _Nodes:
 
 
 class _Chain:
+    def __init__(self, verbose: bool = False):
+        _set_verbose(verbose)
+
     def callpp(self):
+        from chainfury import Chain, Edge, programatic_actions_registry
+
         p1 = programatic_actions_registry.get("call_api_requests")
         p2 = programatic_actions_registry.get("regex_substitute")
         e = Edge(p1.id, "text", p2.id, "text")
         c = Chain([p1, p2], [e], sample={"url": ""}, main_in="url", main_out=f"{p2.id}/text")
-        print("CHAIN:", c)
+        log.debug("CHAIN: %s", c)
 
         # run the chain
         out, full_ir = c(
@@ -119,10 +231,12 @@ class _Chain:
                 "repl": "booboo-hooooo",
             },
         )
-        print("BUFF:", pformat(full_ir))
+        log.debug("BUFF: %s", full_ir)
         print("OUT:", pformat(out))
 
     def callpj(self, fail: bool = False):
+        from chainfury import Chain, Edge, programatic_actions_registry, ai_actions_registry
+
         p = programatic_actions_registry.get("call_api_requests")
 
         # create a new ai action to build a poem
@@ -153,8 +267,10 @@ class _Chain:
             outputs={
                 "chat_reply": ("choices", 0, "message", "content"),
             },
+            # near duplicate API responses get the same explanation, set FURY_CACHE_DIR to keep these across runs
+            similarity_threshold=0.95,
         )
-        print("ACTION:", j)
+        log.debug("ACTION: %s", j)
 
         e = Edge(p.id, "text", j.id, "json_thingy")
 
@@ -167,7 +283,7 @@ class _Chain:
             main_in="url",
             main_out=f"{j.id}/chat_reply",
         )
-        print("CHAIN:", c)
+        log.debug("CHAIN: %s", c)
 
         # run the chain
         out, full_ir = c(
@@ -178,17 +294,19 @@ class _Chain:
                 "openai_api_key": _get_openai_token(),
             }
         )
-        print("BUFF:", pformat(full_ir))
+        log.debug("BUFF: %s", full_ir)
         print("OUT:", pformat(out))
 
     def calljj(self):
+        from chainfury import Chain, Edge, ai_actions_registry
+
         j1 = ai_actions_registry.get("hello-world")
-        print("ACTION:", j1)
+        log.debug("ACTION: %s", j1)
         j2 = ai_actions_registry.get("deep-rap-quote")
-        print("ACTION:", j2)
+        log.debug("ACTION: %s", j2)
         e = Edge(j1.id, "generations", j2.id, "character")
         c = Chain([j1, j2], [e], sample={"message": "hello world"}, main_in="message", main_out=f"{j2.id}/chat_reply")
-        print("CHAIN:", c)
+        log.debug("CHAIN: %s", c)
 
         # run the chain
         out, full_ir = c(
@@ -197,12 +315,45 @@ class _Chain:
                 "message": "hello world",
             }
         )
-        print("BUFF:", pformat(full_ir))
+        log.debug("BUFF: %s", full_ir)
         print("OUT:", pformat(out))
 
-    def callj3(self, quote: str, n: int = 4, thoughts: bool = False, to_json: bool = False):
-        findQuote = ai_actions_registry.register(
-            node_id="find-quote",
+    def callj3(self, quote: str, n: int = 4, thoughts: bool = False, to_json: bool = False, stream: bool = False):
+        c, summary_keys = _build_callj3_chain()
+        rapMaker = c.nodes["deep-rap-quote"]
+        log.debug("CHAIN: %s", c)
+
+        sample_input = {"openai_api_key": _get_openai_token(), "quote": quote, "story_size": n}  # these will also act like defaults
+        # sample_input = {"quote": quote, "story_size": n}  # these will also act like defaults
+
+        if to_json:
+            print(json.dumps(c.to_dict("quote", f"{rapMaker.id}/chat_reply", sample_input), indent=2))
+            return
+
+        # run the chain, only the last node streams its reply to the terminal
+        sample_input["openai_api_key"] = _get_openai_token()
+        if stream:
+            sample_input[f"{rapMaker.id}/stream"] = True
+        out, full_ir = c(
+            sample_input,
+            print_thoughts=thoughts,
+        )
+
+        print("SUMMARY:", {k: full_ir.get(key, {}).get("value", "NulL") for k, key in summary_keys.items()})
+        print("OUT:", out)
+
+    def batch_callj3(self, quotes_file: str, k: int = 6, n: int = 4):
+        """Run callj3 over a file with one quote per line, `k` quotes are answered in a single prompt for the first two steps"""
+        from chainfury import ai_actions_registry
+
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        with open(quotes_file) as f:
+            quotes = [x.strip() for x in f if x.strip()]
+
+        findQuotes = ai_actions_registry.to_action(
+            action_name="find-quote-batch",
+            node_id="find-quote-batch",
             model_id="openai-chat",
             model_params={
                 "model": "gpt-3.5-turbo",
@@ -211,7 +362,7 @@ class _Chain:
                 "messages": [
                     {
                         "role": "user",
-                        "content": "'{{ quote }}' \nWho said this quote, if you don't know then reply with a random character from history world? Give reply in less than 10 words.",
+                        "content": "For each quote below say who said it, if you don't know then reply with a random character from history world. Reply with 'Ak: <character>' on its own line for each 'Qk', in less than 10 words.\n\n{{ quotes }}",
                     },
                 ],
             },
@@ -219,56 +370,63 @@ class _Chain:
                 "chat_reply": ("choices", 0, "message", "content"),
             },
         )
-
-        charStory = ai_actions_registry.register(
-            node_id="tell-character-story",
+        charStories = ai_actions_registry.to_action(
+            action_name="tell-character-story-batch",
+            node_id="tell-character-story-batch",
             model_id="openai-chat",
             model_params={
                 "model": "gpt-3.5-turbo",
             },
             fn={
                 "messages": [
-                    {"role": "user", "content": "Tell a small {{ story_size }} line story about '{{ character_name }}'"},
+                    {
+                        "role": "user",
+                        "content": "Tell a small story about each character below. Start the story for 'Qk' with 'Ak:' on a new line.\nLength: {{ story_size }} lines\n\n{{ quotes }}",
+                    },
                 ],
             },
             outputs={
-                "characters_story": ("choices", 0, "message", "content"),
+                "chat_reply": ("choices", 0, "message", "content"),
             },
         )
         rapMaker = ai_actions_registry.get("deep-rap-quote")
-        e1 = Edge(findQuote.id, "chat_reply", charStory.id, "character_name")
-        e2 = Edge(charStory.id, "characters_story", rapMaker.id, "character")
-        c = Chain(
-            [findQuote, charStory, rapMaker],
-            [e1, e2],
-            sample={"quote": quote},
-            main_in="quote",
-            main_out=f"{rapMaker.id}/chat_reply",
-        )
-        print("CHAIN:", c)
 
-        sample_input = {"openai_api_key": _get_openai_token(), "quote": quote, "story_size": n}  # these will also act like defaults
-        # sample_input = {"quote": quote, "story_size": n}  # these will also act like defaults
-
-        if to_json:
-            print(json.dumps(c.to_dict("quote", f"{rapMaker.id}/chat_reply", sample_input), indent=2))
-            return
-
-        # run the chain
-        sample_input["openai_api_key"] = _get_openai_token()
-        out, full_ir = c(
-            sample_input,
-            print_thoughts=thoughts,
-        )
-
-        print("BUFF:", pformat(full_ir))
-        print("OUT:", pformat(out))
+        results = []
+        for i in range(0, len(quotes), k):
+            batch = quotes[i : i + k]
+            numbered = "\n".join(f"Q{j}: {q}" for j, q in enumerate(batch, 1))
+            out, err = findQuotes({"openai_api_key": _get_openai_token(), "quotes": numbered})
+            if err:
+                print("ERROR:", err)
+                print("TRACE:", out)
+                return
+            characters = _parse_numbered(out["chat_reply"], len(batch))
+
+            numbered = "\n".join(f"Q{j}: {c}" for j, c in enumerate(characters, 1))
+            out, err = charStories({"openai_api_key": _get_openai_token(), "quotes": numbered, "story_size": n})
+            if err:
+                print("ERROR:", err)
+                print("TRACE:", out)
+                return
+            stories = _parse_numbered(out["chat_reply"], len(batch))
+
+            for quote, character, story in zip(batch, characters, stories):
+                out, err = rapMaker({"openai_api_key": _get_openai_token(), "character": story})
+                if err:
+                    print("ERROR:", err)
+                    print("TRACE:", out)
+                    return
+                results.append({"quote": quote, "character": character, "story": story, "rap": out["chat_reply"]})
+
+        print("OUT:", pformat(results))
 
     def from_json(self, quote: str = "", n: int = 4, mainline: bool = False, thoughts: bool = False, path: str = "./stories/fury.json"):
+        from chainfury import Chain
+
         with open(path) as f:
             dag = json.load(f)
         c = Chain.from_dict(dag)
-        print("CHAIN:", c)
+        log.debug("CHAIN: %s", c)
 
         if mainline:
             input = quote
@@ -283,25 +441,92 @@ class _Chain:
             input,
             print_thoughts=thoughts,
         )
-        print("BUFF:", pformat(full_ir))
+        log.debug("BUFF: %s", full_ir)
         print("OUT:", pformat(out))
 
 
 if __name__ == "__main__":
+    import argparse
 
-    def help():
-        return """
+    HELP = """
 Fury Story
 ==========
 
-python3 -m stories.fury nodes callp [--fail]
+python3 -m stories.fury nodes callp [--fail] [--verbose]
 python3 -m stories.fury nodes callai [--jtype --fail]
 python3 -m stories.fury nodes callai_chat [--jtype --fail]
 
 python3 -m stories.fury chain callpp
 python3 -m stories.fury chain callpj
 python3 -m stories.fury chain calljj
-python3 -m stories.fury chain callj3 --quote QUOTE
+python3 -m stories.fury chain callj3 --quote QUOTE [--stream]
+python3 -m stories.fury chain batch_callj3 --quotes_file PATH [--k 6]
 """.strip()
 
-    fire.Fire({"nodes": _Nodes, "chain": _Chain, "help": help})
+    # argparse instead of fire, the CLI is run in shell loops and fire's introspection is slow to start
+    flag = lambda name: ((name,), {"action": "store_true"})
+    opt = lambda name, type, **kw: ((name,), {"type": type, **kw})
+
+    def positive_int(x: str) -> int:
+        if int(x) < 1:
+            raise argparse.ArgumentTypeError(f"must be at least 1, got {x}")
+        return int(x)
+
+    commands = {
+        "nodes": (
+            _Nodes,
+            {
+                "callp": [flag("--fail")],
+                "callm": [flag("--fail")],
+                "callai": [flag("--fail")],
+                "callai_chat": [opt("--character", str, default="a mexican taco")],
+            },
+        ),
+        "chain": (
+            _Chain,
+            {
+                "callpp": [],
+                "callpj": [flag("--fail")],
+                "calljj": [],
+                "callj3": [
+                    opt("--quote", str, required=True),
+                    opt("--n", int, default=4),
+                    flag("--thoughts"),
+                    flag("--to_json"),
+                    flag("--stream"),
+                ],
+                "batch_callj3": [
+                    opt("--quotes_file", str, required=True),
+                    opt("--k", positive_int, default=6),
+                    opt("--n", int, default=4),
+                ],
+                "from_json": [
+                    opt("--quote", str, default=""),
+                    opt("--n", int, default=4),
+                    flag("--mainline"),
+                    flag("--thoughts"),
+                    opt("--path", str, default="./stories/fury.json"),
+                ],
+            },
+        ),
+    }
+
+    parser = argparse.ArgumentParser(prog="stories.fury", description=HELP, formatter_class=argparse.RawDescriptionHelpFormatter)
+    groups = parser.add_subparsers(dest="group", required=True)
+    groups.add_parser("help")
+    for group, (cls, methods) in commands.items():
+        group_parser = groups.add_parser(group).add_subparsers(dest="method", required=True)
+        for method, arguments in methods.items():
+            method_parser = group_parser.add_parser(method, help=getattr(cls, method).__doc__)
+            method_parser.add_argument("--verbose", action="store_true")
+            for a, kw in arguments:
+                method_parser.add_argument(*a, **kw)
+
+    args = vars(parser.parse_args())
+    group = args.pop("group")
+    if group == "help":
+        print(HELP)
+    else:
+        method = args.pop("method")
+        obj = commands[group][0](verbose=args.pop("verbose"))
+        getattr(obj, method)(**args)